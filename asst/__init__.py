@@ -1,12 +1,16 @@
-from flask import Flask, render_template, flash
-from peewee import MySQLDatabase, fn
+from flask import Flask, render_template, flash, request
+from peewee import fn
+from playhouse.pool import PooledMySQLDatabase
 import sys, traceback
 import flask_login
 
 
 def init_db():
     global DB
-    DB = MySQLDatabase(host="ofmc.me",port=3306,user="cs336",passwd="password",database="cs336")
+    # Pooled so each request reuses an open connection instead of reconnecting to the server
+    # A full pool waits up to timeout seconds for a free connection instead of failing the request
+    DB = PooledMySQLDatabase("cs336", max_connections=32, stale_timeout=300, timeout=10,
+                             host="ofmc.me",port=3306,user="cs336",passwd="password")
 
 
 APP = Flask(__name__, template_folder="views/templates", static_url_path='/static')
@@ -17,6 +21,22 @@ LM.init_app(APP)
 
 init_db()
 
+@APP.before_request
+def db_connect():
+    '''Checks a connection out of the pool for this request
+
+    Static files never touch the DB, and the thread may already hold a connection
+    from a query made outside a request
+    '''
+    if request.endpoint != 'static' and DB.is_closed():
+        DB.connect()
+
+@APP.teardown_request
+def db_close(exc):
+    '''Returns the request's connection to the pool'''
+    if not DB.is_closed():
+        DB.close()
+
 import asst.auth
 
 # Register all views after here
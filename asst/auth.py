@@ -10,26 +10,34 @@ import flask_login
 import sys, traceback
 from asst import LM as login_manager
 from asst.models import User
-from werkzeug.security import check_password_hash
+from asst.models.user import PASSWORD_HASH_METHOD
+from werkzeug.security import check_password_hash, generate_password_hash
 
 auth_pages = Blueprint('auth_pages', __name__, template_folder="./views/templates")
 
+# Checked against when the email is unknown so a failed login takes the same time either way
+DUMMY_HASH = generate_password_hash("invalid", method=PASSWORD_HASH_METHOD)
+
 @login_manager.user_loader
 def user_loader(email):
     '''Loads the user via a DB call
 
+    The result is cached on flask.g, since flask-login can call this several times per request.
+
     Args:
         email (str): The email to load
 
     Returns:
         User: The user object corresponding to the email passed, or None if it doesn't exist
     '''
+    cache = getattr(flask.g, '_user_cache', None)
+    if cache is None:
+        cache = flask.g._user_cache = {}
+    if email in cache:
+        return cache[email]
     try:
-        users = User.select().where(User.Email == email)
-        if len(users) > 0:
-            return users[0]
-        else:
-            return
+        cache[email] = User.get_by_email(email)
+        return cache[email]
     except Exception as e:
         traceback.print_exc(file=sys.stdout)
 
@@ -77,16 +85,18 @@ def require_role(role,**kwargss):
 
     If a user is not authorized then the flask_login.unauthorized handler is called.
     '''
+    # Resolved once here rather than on every request
+    allowed = frozenset(role) if isinstance(role, (list, tuple)) else frozenset((role,))
+    getrole = kwargss.get('getrole', False)
+
     def real_wrap(func):
         @wraps(func)
         @flask_login.login_required
         def wrapper(*args, **kwargs):
             user = flask_login.current_user
-            if kwargss.get('getrole', False):
+            if getrole:
                 args = tuple([user.role])
-            if isinstance(role, list) and user.role in role:
-                return func(*args, **kwargs)
-            elif user.role == role:
+            if user.role in allowed:
                 return func(*args, **kwargs)
             else:
                 return login_manager.unauthorized()
@@ -104,15 +114,19 @@ def login():
             return render_template('login.html', logged_in = False)
 
         email = flask.request.form['email']
-        users = User.select().where(User.Email == email)
-
-        if len(users) <= 0:
-            flash('Unable to login user {}'.format(email), 'danger')
-            return render_template('login.html', logged_in = False)
-        else:
-            user = users[0]
-
-        if check_password_hash(user.password, flask.request.form['pw']):
+        user = User.get_by_email(email)
+
+        if user is None:
+            # Same hashing work and same response as a wrong password, so unknown emails can't be told apart
+            check_password_hash(DUMMY_HASH, flask.request.form['pw'])
+        elif check_password_hash(user.password, flask.request.form['pw']):
+            # Older hashes verify faster than DUMMY_HASH, so bring them up to the current cost
+            if user.password.split('$', 1)[0] != PASSWORD_HASH_METHOD:
+                try:
+                    user.password = generate_password_hash(flask.request.form['pw'], method=PASSWORD_HASH_METHOD)
+                    user.save()
+                except Exception:
+                    traceback.print_exc(file=sys.stdout)
             user.id = user.Email
             flask_login.login_user(user)
             return flask.redirect(flask.url_for('index'))
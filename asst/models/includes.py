@@ -1,8 +1,9 @@
 '''The basic user model (For logins)
 The users will have roles i.e. chef, manager, host, waitress, etc..
 '''
-from peewee import CharField, IntegrityError, IntegerField, FloatField, CompositeKey
+from peewee import CharField, IntegrityError, IntegerField, FloatField, CompositeKey, ForeignKeyField
 from asst.models import BaseModel
+from asst.models.res import Reservation
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash
 
@@ -12,7 +13,7 @@ class Inc_Breakfast(UserMixin, BaseModel):
         primary_key = CompositeKey('BType', 'InvoiceNo', 'HotelID')
 
     BType = CharField()
-    InvoiceNo = IntegerField()
+    InvoiceNo = ForeignKeyField(Reservation, db_column='InvoiceNo', related_name='inc_breakfast_set', index=True)
     HotelID = IntegerField()
 
 
@@ -34,7 +35,7 @@ class Cont_Service(UserMixin, BaseModel):
         primary_key = CompositeKey('sType', 'InvoiceNo', 'HotelID')
 
     sType = CharField()
-    InvoiceNo = IntegerField()
+    InvoiceNo = ForeignKeyField(Reservation, db_column='InvoiceNo', related_name='cont_service_set', index=True)
     HotelID = IntegerField()
 
 
@@ -9,6 +9,9 @@ from werkzeug.security import generate_password_hash
 class Reservation(UserMixin, BaseModel):
     class Meta:
         db_table = 'Reservation'
+        indexes = (
+            (('CID', 'InvoiceNo'), False),
+        )
     '''A User model for who will be using the software. Users have different levels of access with different roles
     Current active roles:
         - customer
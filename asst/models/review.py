@@ -49,14 +49,14 @@ class writes_Review(UserMixin, BaseModel):
             TextComment : textual description customer gives
             CID : customer identification
         Returns:
-            N/A
+            writes_Review: The created review, with its ReviewID set
 
         Raises:
             ValueError: When cid already exists
         '''
 
         try:
-                cls.create(
+            return cls.create(
                 Rating = rating,
                 TextComment = text_comment,
                 CID = cid,
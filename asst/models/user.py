@@ -6,6 +6,9 @@ from asst.models import BaseModel
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash
 
+# Pinned so the hashing cost doesn't change with werkzeug's defaults
+PASSWORD_HASH_METHOD = 'pbkdf2:sha256:600000'
+
 class User(UserMixin, BaseModel):
     class Meta:
         db_table = 'Customer'
@@ -46,10 +49,25 @@ class User(UserMixin, BaseModel):
         try:
             cls.create(
                 Email=email,
-                password=generate_password_hash(password),
+                password=generate_password_hash(password, method=PASSWORD_HASH_METHOD),
                 Name=name,
                 Phone_no = phone_no,
                 Address = address,
                 role=role)
         except IntegrityError:
             raise ValueError("User already exists")
+
+    @classmethod
+    def get_by_email(cls, email):
+        '''Looks up a single user by email
+
+        Email is unique, so this is a LIMIT 1 lookup. It only uses an index once the
+        Customer table has one on Email (see CREATE UNIQUE INDEX customer_Email ON Customer (Email)).
+
+        Args:
+            email(str): The user email
+
+        Returns:
+            User: The matching user, or None if there isn't one
+        '''
+        return cls.select().where(cls.Email == email).first()
@@ -1,32 +1,29 @@
-from flask import Blueprint, render_template, abort, flash
-from flask import request
+from flask import Blueprint, render_template, flash
+from flask import request, session
+from asst import DB
 from asst.auth import require_role
-from itertools import *
-from asst.models import hotel, room, breakfast, service,  res, review, includes, roomreview_evaluates, breakfastreview_asseses, servicereview_rates
-from flask_table import Table, Col, ButtonCol
+from asst.models import room, res, review, includes, roomreview_evaluates, breakfastreview_asseses, servicereview_rates
+from flask_table import Table, Col
+from peewee import JOIN, prefetch
 import flask_login
-import datetime
-from dateutil.parser import parse
-import traceback, sys
-import math
-import random
-import json
-import time
+import logging
+import orjson
 
 page = Blueprint('feedback', __name__, template_folder='templates')
-inv_no = '1'
-rrate = '-1'
-bfrate = '-1'
-srate = '-1'
-ReviewType = '-1'
-choice = 'no'
-servtype = "sno"
-breakftype = "bno"
-rootype = 'rno'
-rno = '1'
-hid = '0'
-ReviewIDtest = '0'
-class ItemTable(Table):
+log = logging.getLogger(__name__)
+
+class CachedHeadTable(Table):
+    '''
+    A Table that renders its <thead> once per class instead of once per request.
+    Only for tables without sorting or per-instance thead classes, since the header is then always the same
+    '''
+    def thead(self):
+        cls = type(self)
+        if '_thead_html' not in cls.__dict__:
+            cls._thead_html = super().thead()
+        return cls._thead_html
+
+class ItemTable(CachedHeadTable):
     '''
     This is a itemTable class that generates text/html automatically to create a table for created reservations
     '''
@@ -37,7 +34,7 @@ class ItemTable(Table):
     room_no = Col('Room Number')
     hotel_id = Col('Hotel ID')
 
-class ItemTable2(Table):
+class ItemTable2(CachedHeadTable):
     '''
     This is a itemTable class that generates text/html automatically to create a table for created reservations
     '''
@@ -46,7 +43,7 @@ class ItemTable2(Table):
     inv = Col('Invoice No')
     hotel_id = Col('Hotel ID')
 
-class ItemTable3(Table):
+class ItemTable3(CachedHeadTable):
     '''
     This is a itemTable class that generates text/html automatically to create a table for created reservations
     '''
@@ -55,11 +52,54 @@ class ItemTable3(Table):
     brktype = Col('Breakfast Type')
     hotel_id = Col('Hotel ID')
 
+def _ordered_room(cid, inv_no, rtype):
+    '''Checks whether the customer's reservation was for a room of the given type'''
+    return (res.Reservation
+            .select()
+            .join(room.Room, on=((res.Reservation.Room_no == room.Room.Room_no) &
+                                 (res.Reservation.HotelID == room.Room.HotelID)))
+            .where(res.Reservation.CID == cid, res.Reservation.InvoiceNo == inv_no, room.Room.Type == rtype)
+            .exists())
+
+def _ordered_breakfast(cid, inv_no, btype):
+    '''Checks whether the customer's reservation included a breakfast of the given type'''
+    return (includes.Inc_Breakfast
+            .select()
+            .join(res.Reservation)
+            .where(res.Reservation.CID == cid, includes.Inc_Breakfast.InvoiceNo == inv_no, includes.Inc_Breakfast.BType == btype)
+            .exists())
+
+def _ordered_service(cid, inv_no, stype):
+    '''Checks whether the customer's reservation included a service of the given type'''
+    return (includes.Cont_Service
+            .select()
+            .join(res.Reservation)
+            .where(res.Reservation.CID == cid, includes.Cont_Service.InvoiceNo == inv_no, includes.Cont_Service.sType == stype)
+            .exists())
+
+# ReviewType -> (session rating key, session item type key, form field, ordered check, review link, session link key)
+REVIEW_TYPES = {
+    1: ('rrate', 'rtype', 'description', _ordered_room, roomreview_evaluates.RoomReview_evaluates.create_rmreview, 'rno'),
+    2: ('bfrate', 'bftype', 'description2', _ordered_breakfast, breakfastreview_asseses.BreakfastReview_asseses.create_brkreview, 'bftype'),
+    3: ('srate', 'stype', 'description3', _ordered_service, servicereview_rates.ServiceReview_rates.create_servreview, 'stype'),
+}
+
 @page.route('/', methods=['GET'])
 @require_role(['admin','manager', 'customer'],getrole=True) # Example of requireing a role(and authentication)
 def feedback(role):
     return render_template('feedback/index.html', logged_in=True,role=role)
 
+def _prefetched(instance, related_name):
+    '''Returns the rows prefetch() attached under a backref
+
+    peewee 2 stores them on <related_name>_prefetch and leaves the backref itself as a query,
+    while peewee 3 puts them on the backref directly
+    '''
+    prefetch_attr = related_name + '_prefetch'
+    if hasattr(instance, prefetch_attr):
+        return getattr(instance, prefetch_attr)
+    return getattr(instance, related_name)
+
 @page.route("/pick_res",methods=['GET'])
 @require_role(['admin','manager', 'customer'],getrole=True) # Example of requireing a role(and authentication)
 def pick_res(role):
@@ -67,39 +107,33 @@ def pick_res(role):
     reserv2 = []
     reserv3 = []
     hotel_id = -1
-    global inv_no
-    global rno
-    global hid
     try:
         user = flask_login.current_user
         cid = user.CID
         INV_NO = request.args.get('id')
         inv_no = INV_NO
+        session['inv_no'] = inv_no
     except:
-        traceback.print_exc(file=sys.stdout)
+        log.exception("Could not read the selected invoice")
         flash("Could not find any rooms for the specified dates", 'danger')
         return render_template('feedback/index.html', logged_in=True,role=role)
-    for r in res.Reservation.select().where(res.Reservation.CID == cid, res.Reservation.InvoiceNo == inv_no):
-        try:
-            reserv.append(dict(inv = r.InvoiceNo, ordered = r.ResDate, out_date = r.OutDate, in_date = r.InDate, room_no = r.Room_no, hotel_id = r.HotelID, \
-                               cnumber = r.CNumber, totalamt = r.TotalAmt, cid = r.CID))
-            rno = r.Room_no
-            hid = r.HotelID
-        except:
-            traceback.print_exc(file=sys.stdout)
-            continue
-    for s in includes.Cont_Service.select().where(includes.Cont_Service.InvoiceNo == inv_no):
-        try:
-            reserv2.append(dict(serv = s.sType, inv = s.InvoiceNo, hotel_id = s.HotelID ))
-        except:
-            traceback.print_exc(file=sys.stdout)
-            continue
-    for bf in includes.Inc_Breakfast.select().where(includes.Inc_Breakfast.InvoiceNo == inv_no):
-        try:
-            reserv3.append(dict(inv = bf.InvoiceNo, brktype = bf.BType, hotel_id = bf.HotelID))
-        except:
-            traceback.print_exc(file=sys.stdout)
-            continue
+    # Only the columns ItemTable shows; prefetch still needs model rows to attach the children to
+    reservations = (res.Reservation
+                    .select(res.Reservation.InvoiceNo, res.Reservation.OutDate, res.Reservation.InDate, res.Reservation.Room_no, res.Reservation.HotelID)
+                    .where(res.Reservation.CID == cid, res.Reservation.InvoiceNo == inv_no))
+    try:
+        for r in prefetch(reservations, includes.Cont_Service, includes.Inc_Breakfast):
+            reserv.append({'inv': r.InvoiceNo, 'out_date': r.OutDate, 'in_date': r.InDate, 'room_no': r.Room_no, 'hotel_id': r.HotelID})
+            session['rno'] = r.Room_no
+            session['hid'] = r.HotelID
+            for s in _prefetched(r, 'cont_service_set'):
+                reserv2.append({'serv': s.sType, 'inv': r.InvoiceNo, 'hotel_id': s.HotelID})
+            for bf in _prefetched(r, 'inc_breakfast_set'):
+                reserv3.append({'inv': r.InvoiceNo, 'brktype': bf.BType, 'hotel_id': bf.HotelID})
+    except:
+        log.exception("Could not load invoice %s", inv_no)
+        flash("There was an error processing your request. Please try again", 'danger')
+        return render_template('feedback/index.html', logged_in=True,role=role)
     table = ItemTable(reserv)
     table2 = ItemTable2(reserv2)
     table3 = ItemTable3(reserv3)
@@ -108,37 +142,29 @@ def pick_res(role):
 @page.route("/rating", methods=['POST'])
 @require_role(['admin','manager', 'customer'],getrole=True) # Example of requireing a role(and authentication)
 def get_rating_and_global(role):
-    global rrate
-    global bfrate
-    global srate
-    global ReviewType
-    global rtype
-    global bftype
-    global stype
-    global rate
     hold = []
     try:
-        data = request.get_json()
+        data = orjson.loads(request.get_data())
 
         rate = data['radioValue']
         RevType = data['ReviewType']
         if(RevType == 1):
-            rrate = rate
+            session['rrate'] = rate
         elif(RevType == 2):
-            bfrate = rate
+            session['bfrate'] = rate
         elif(RevType == 3):
-            srate = rate
+            session['srate'] = rate
         roomtype = data['rootype']
         breaktype = data['breakftype']
         servtype = data['servtype']
-        ReviewType = RevType
-        rtype = roomtype
-        bftype = breaktype
-        stype = servtype
+        session['ReviewType'] = RevType
+        session['rtype'] = roomtype
+        session['bftype'] = breaktype
+        session['stype'] = servtype
         hold.append([RevType])
-        return json.dumps(hold)
+        return orjson.dumps(hold)
     except Exception as e:
-        traceback.print_exc(file=sys.stdout)
+        log.exception("Could not save the review selection")
         return "Error", 500
 
 
@@ -146,7 +172,7 @@ def get_rating_and_global(role):
 @require_role(['admin','manager', 'customer'],getrole=True) # Example of requireing a role(and authentication)
 def get_reserv(role):
     try:
-        data = request.get_json()
+        data = orjson.loads(request.get_data())
         RevType = data['RevType']
         reserv = []
     #    bf = 'none'
@@ -154,133 +180,53 @@ def get_reserv(role):
         rmtype = 'none'
         user = flask_login.current_user
         cid = user.CID
-        for r in res.Reservation.select().where(res.Reservation.CID == cid):
-            invoic_no = r.InvoiceNo
-           # for b in includes.Inc_Breakfast.select().where(includes.Inc_Breakfast.InvoiceNo == invoic_no):
-            #    bf.append(b)
-           # for se in includes.Cont_Service.select().where(includes.Cont_Service.InvoiceNo == invoic_no):
-           #     serv.append(se)
-            for rt in room.Room.select().where(room.Room.Room_no == r.Room_no):
-                rmtype = rt.Type
-            reserv.append([r.HotelID, rmtype, r.Room_no, r.InvoiceNo])
-        return json.dumps(reserv)
+        query = (res.Reservation
+                 .select(res.Reservation.HotelID, room.Room.Type, res.Reservation.Room_no, res.Reservation.InvoiceNo)
+                 .join(room.Room, JOIN.LEFT_OUTER, on=((res.Reservation.Room_no == room.Room.Room_no) &
+                                                       (res.Reservation.HotelID == room.Room.HotelID)))
+                 .where(res.Reservation.CID == cid)
+                 .tuples()
+                 .iterator())
+        for hotel_id, rtype, room_no, invoic_no in query:
+            reserv.append([hotel_id, rtype if rtype is not None else rmtype, room_no, invoic_no])
+        return orjson.dumps(reserv)
     except Exception as e:
-        traceback.print_exc(file=sys.stdout)
+        log.exception("Could not load reservations")
         return "Error", 500
 
     return render_template('feedback/index.html', logged_in=True,role=role)
+
 @page.route('/success',methods=['GET', 'POST'])
 @require_role(['admin','manager', 'customer'],getrole=True) # Example of requireing a role(and authentication)
 def rreview(role):
-    SCounter = 0
-    global inv_no
-    print(str(inv_no))
-    global ReviewType
-    global rtype
-    global bftype
-    global stype
-    global rrate
-    global bfrate
-    global srate
-    global rno
-    global hid
-    global ReviewIDtest
-    print(str(ReviewType))
-    print(str(rrate))
-    print(str(rtype))
-    Text = 'hi'
-    if SCounter == 0:
-        try:
-            user = flask_login.current_user
-            cid = user.CID
-            if ReviewType == 1:
-                for q in res.Reservation.select().where(res.Reservation.CID == cid, res.Reservation.InvoiceNo == inv_no):
-                    print("Reservation: " + str(q))
-                    try:
-                        for rm in room.Room.select().where(room.Room.HotelID == q.HotelID, room.Room.Room_no == q.Room_no):
-                            print("Room Info: " + str(rm))
-                            print("Room Type: " + str(rm.Type))
-                            try:
-                                if rm.Type == rtype:
-                                    Text = request.form['description']
-                                    print("Room Description: " + str(Text))
-                                    SCounter += 1
-                                    #rvw = review.writes_Review.create_review(rrate, Text, cid, inv_no)
-                            except:
-                                continue
-                    except:
-                        traceback.print_exc(file=sys.stdout)
-                        flash("There was an error processing your request. Please try again", 'danger')
-                        return render_template('feedback/index.html', logged_in=True, role=role)
-            elif ReviewType == 2:
-                for q in res.Reservation.select().where(res.Reservation.CID == cid, res.Reservation.InvoiceNo == inv_no):
-                    print("Reservation: " + str(q))
-                    try:
-                        for food in includes.Inc_Breakfast.select().where(includes.Inc_Breakfast.InvoiceNo == inv_no):
-                            print("Breakfast Info: " + str(food))
-                            print("Breakfast Type: " + str(food.BType))
-                            try:
-                                if food.BType == bftype:
-                                    Text = request.form['description2']
-                                    print("Food Description: " + str(Text))
-                                    SCounter += 1
-                                    #rvw = review.writes_Review.create_review(bfrate, Text, cid, inv_no)
-                            except:
-                                continue
-                    except:
-                        traceback.print_exc(file=sys.stdout)
-                        flash("There was an error processing your request. Please try again", 'danger')
-                        return render_template('feedback/index.html', logged_in=True, role=role)
-            elif ReviewType == 3:
-                for q in res.Reservation.select().where(res.Reservation.CID == cid, res.Reservation.InvoiceNo == inv_no):
-                    print("Reservation: " + str(q))
-                    try:
-                        for ser in includes.Cont_Service.select().where(includes.Cont_Service.InvoiceNo == inv_no):
-                            print("Service Info: " + str(ser))
-                            print("Service Type: " + str(ser.sType))
-                            try:
-                                if ser.sType == stype:
-                                    Text = request.form['description3']
-                                    print("Service Description: " + str(Text))
-                                    SCounter += 1
-                                    #rvw = review.writes_Review.create_review(srate, Text, cid, inv_no)
-                            except:
-                                continue
-                    except:
-                        traceback.print_exc(file=sys.stdout)
-                        flash("There was an error processing your request. Please try again", 'danger')
-                        return render_template('feedback/index.html', logged_in=True, role=role)
-        except:
-            traceback.print_exc(file=sys.stdout)
-            flash("There was an error processing your request. Please try again", 'danger')
-            return render_template('feedback/index.html', logged_in=True,role=role)
-        if SCounter > 0:
-            if ReviewType == 1:
-                rvw = review.writes_Review.create_review(rrate, Text, cid, inv_no)
-                for test in review.writes_Review.select().where(review.writes_Review.Rating == rrate, review.writes_Review.TextComment == Text, review.writes_Review.InvoiceNo == inv_no):
-                    try:
-                        ReviewIDtest = test.ReviewID
-                    except:
-                        continue
-                rmrvw = roomreview_evaluates.RoomReview_evaluates.create_rmreview(ReviewIDtest, rno, hid)
-            elif ReviewType == 2:
-                rvw = review.writes_Review.create_review(bfrate, Text, cid, inv_no)
-                for test in review.writes_Review.select().where(review.writes_Review.Rating == bfrate, review.writes_Review.TextComment == Text, review.writes_Review.InvoiceNo == inv_no):
-                    try:
-                        ReviewIDtest = test.ReviewID
-                    except:
-                        continue
-                bfrvw = breakfastreview_asseses.BreakfastReview_asseses.create_brkreview(ReviewIDtest, bftype, hid)
-            elif ReviewType == 3:
-                rvw = review.writes_Review.create_review(srate, Text, cid, inv_no)
-                for test in review.writes_Review.select().where(review.writes_Review.Rating == srate, review.writes_Review.TextComment == Text, review.writes_Review.InvoiceNo == inv_no):
-                    try:
-                        ReviewIDtest = test.ReviewID
-                    except:
-                        continue
-                srvw = servicereview_rates.ServiceReview_rates.create_servreview(ReviewIDtest, stype, hid)
-            return render_template('feedback/success.html', logged_in=True, role=role)
-        else:
+    # Selections made on the previous pages are kept in the user's session
+    inv_no = session.get('inv_no', '1')
+    log.debug("Invoice: %s", inv_no)
+    ReviewType = session.get('ReviewType', '-1')
+    hid = session.get('hid', '0')
+    log.debug("Review Type: %s", ReviewType)
+    if ReviewType not in REVIEW_TYPES:
+        flash("error, please review only for things that were actually ordered.", 'danger')
+        return render_template('feedback/index.html', logged_in=True, role=role)
+    rate_key, type_key, form_field, ordered, create_link, link_key = REVIEW_TYPES[ReviewType]
+    rate = session.get(rate_key, '-1')
+    item_type = session.get(type_key)
+    log.debug("Rating: %s", rate)
+    log.debug("Item Type: %s", item_type)
+    try:
+        user = flask_login.current_user
+        cid = user.CID
+        if not ordered(cid, inv_no, item_type):
             flash("error, please review only for things that were actually ordered.", 'danger')
             return render_template('feedback/index.html', logged_in=True, role=role)
-
+        Text = request.form[form_field]
+        log.debug("Review Description: %s", Text)
+    except:
+        log.exception("Could not validate review for invoice %s", inv_no)
+        flash("There was an error processing your request. Please try again", 'danger')
+        return render_template('feedback/index.html', logged_in=True,role=role)
+    # The review and its link row are written together or not at all
+    with DB.atomic():
+        rvw = review.writes_Review.create_review(rate, Text, cid, inv_no)
+        create_link(rvw.ReviewID, session.get(link_key, '1'), hid)
+    return render_template('feedback/success.html', logged_in=True, role=role)